@@ -0,0 +1,199 @@
+"""OBS Lite event decoding shared by read_ble.py and read_esp.py."""
+
+import struct
+from collections import namedtuple
+
+DistanceDetails = namedtuple("DistanceDetails", "source_id distance has_distance dm_bytes raw")
+TruncatedDetails = namedtuple("TruncatedDetails", "field expected available raw_hex raw_len")
+
+# Longest prefix of a packet that log lines dump as hex
+HEX_DUMP_LIMIT = 64
+
+_F32 = struct.Struct('<f')
+_DM = struct.Struct('<BBBf')
+
+def hex_prefix(data, limit=HEX_DUMP_LIMIT):
+    """Hex of at most the first `limit` bytes, with '...' appended if cut."""
+    if len(data) > limit:
+        return data[:limit].hex() + "..."
+    return data.hex()
+
+def cobs_decode(data):
+    n = len(data)
+    output = bytearray(n)
+    w = 0
+    i = 0
+    while i < n:
+        code = data[i]
+        if code == 0:
+            break
+        run = code - 1
+        i += 1
+        if i + run > n:
+            return None
+        # Copy the whole zero-free run at once instead of byte by byte
+        output[w:w+run] = data[i:i+run]
+        w += run
+        i += run
+        if code < 0xFF and i < n:
+            output[w] = 0
+            w += 1
+    del output[w:]
+    return output
+
+def decode_varint(data, pos):
+    n = len(data)
+    # Fast path: tags, source ids and lengths almost always fit in 1-2 bytes
+    if pos < n:
+        b0 = data[pos]
+        if b0 < 0x80:
+            return b0, pos + 1
+        if pos + 1 < n:
+            b1 = data[pos + 1]
+            if b1 < 0x80:
+                return (b0 & 0x7F) | (b1 << 7), pos + 2
+    result = 0
+    shift = 0
+    while pos < n:
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            return result | (b << shift), pos
+        result |= (b & 0x7F) << shift
+        shift += 7
+    return result, pos
+
+def _skip_varint(data, pos):
+    _, pos = decode_varint(data, pos)
+    return pos
+
+def _skip_fixed64(data, pos):
+    return pos + 8
+
+def _skip_len(data, pos):
+    length, pos = decode_varint(data, pos)
+    return pos + length
+
+def _skip_fixed32(data, pos):
+    return pos + 4
+
+# Indexed by wire type; None for the deprecated groups (3, 4) and invalid types
+WIRE_TYPE_SKIP = (_skip_varint, _skip_fixed64, _skip_len, None, None, _skip_fixed32, None, None)
+
+def parse_distance_measurement(data):
+    """Parse DistanceMeasurement: field 1=source_id (int32), field 2=distance (float)"""
+    source_id = 0
+    distance = 0.0
+    has_distance = False
+    n = len(data)
+    pos = 0
+    while pos < n:
+        tag, pos = decode_varint(data, pos)
+        if tag == 0x08:  # field 1 source_id, varint
+            source_id, pos = decode_varint(data, pos)
+        elif tag == 0x15:  # field 2 distance, fixed32
+            if pos + 4 <= n:
+                distance = _F32.unpack_from(data, pos)[0]
+                has_distance = True
+                pos += 4
+        else:
+            # skip unknown field
+            skip = WIRE_TYPE_SKIP[tag & 0x07]
+            if skip is None:
+                break
+            pos = skip(data, pos)
+    return source_id, distance, has_distance
+
+def _distance_details(field_data, length):
+    # Canonical layout: 08 <sid> 15 <float32>
+    if length == 7 and field_data[0] == 0x08 and field_data[1] < 0x80 and field_data[2] == 0x15:
+        _, sid, _, dist = _DM.unpack_from(field_data)
+        return DistanceDetails(sid, dist, True, length, field_data)
+    sid, dist, has_dist = parse_distance_measurement(field_data)
+    return DistanceDetails(sid, dist, has_dist, length, field_data)
+
+def _text_details(field_data, length):
+    return bytes(field_data)
+
+# Length-delimited Event fields: tag -> (event_type, details builder or None).
+# An event_type of None (field 6 time) skips the field without changing the result.
+EVENT_FIELDS = {
+    0x52: ("distance", _distance_details),     # field 10 distance_measurement
+    0x62: ("geolocation", None),               # field 12
+    0x6A: ("userInput", None),                 # field 13
+    0x72: ("textMessage", _text_details),      # field 14 text_message
+    0x32: (None, None),                        # field 6 time
+}
+
+def parse_event(data):
+    """Parse top-level Event, return (event_type, details)"""
+    n = len(data)
+    pos = 0
+    event_type = None
+    details = None
+    while pos < n:
+        tag, pos = decode_varint(data, pos)
+        wire_type = tag & 0x07
+        if wire_type == 2:  # length-delimited
+            length, pos = decode_varint(data, pos)
+            if pos + length > n:
+                # Truncated!
+                return "TRUNCATED", TruncatedDetails(tag >> 3, length, n - pos, hex_prefix(data), n)
+            field = EVENT_FIELDS.get(tag)
+            if field is not None and field[0] is not None:
+                event_type, build = field
+                if build is not None:
+                    details = build(data[pos:pos+length], length)
+            # Unknown fields leave event_type alone
+            pos += length
+        else:
+            skip = WIRE_TYPE_SKIP[wire_type]
+            if skip is None:
+                break
+            pos = skip(data, pos)
+    return event_type, details
+
+def _build_parse_event_fast():
+    """Generate parse_event_fast with the EVENT_FIELDS tags inlined as constants.
+
+    It only handles single-byte tags with single-byte lengths, which is every
+    field the sensor sends. Anything else (unknown tags, other wire types, long
+    or truncated fields) is handed to the generic parse_event.
+    """
+    lines = [
+        "def parse_event_fast(data):",
+        "    n = len(data)",
+        "    pos = 0",
+        "    event_type = None",
+        "    details = None",
+        "    while pos < n:",
+        "        if pos + 1 >= n:",
+        "            return parse_event(data)",
+        "        tag = data[pos]",
+        "        length = data[pos + 1]",
+        "        pos += 2",
+        "        end = pos + length",
+        "        if length >= 0x80 or end > n:",
+        "            return parse_event(data)",
+    ]
+    skipped = []
+    branch = "if"
+    for tag, (name, build) in EVENT_FIELDS.items():
+        if name is None:
+            skipped.append(tag)
+            continue
+        lines += [f"        {branch} tag == {tag:#04x}:", f"            event_type = {name!r}"]
+        if build is not None:
+            lines.append(f"            details = {build.__name__}(data[pos:end], length)")
+        branch = "elif"
+    lines += [
+        f"        {branch} tag not in {tuple(skipped)!r}:",
+        "            return parse_event(data)",
+        "        pos = end",
+        "    return event_type, details",
+    ]
+    # Run in the module namespace so the fallback always calls the current parse_event
+    exec(compile("\n".join(lines), "<parse_event_fast>", "exec"), globals())
+    return globals()["parse_event_fast"]
+
+parse_event_fast = _build_parse_event_fast()
@@ -2,159 +2,113 @@
 """Read OBS Lite sensor data via BLE (same as the iOS app receives)."""
 
 import asyncio
-import struct
+import contextlib
 import time
 import sys
+import traceback
 
 from bleak import BleakClient, BleakScanner
 
+from obs_proto import hex_prefix, parse_event_fast
+
 DEVICE_NAME = "OBS Lite LiDAR"
 TX_CHAR_UUID = "6e400003-b5a3-f393-e0a9-e50e24dcca9e"
-
-def decode_varint(data, pos):
-    result = 0
-    shift = 0
-    while pos < len(data):
-        b = data[pos]
-        result |= (b & 0x7F) << shift
-        pos += 1
-        if (b & 0x80) == 0:
-            return result, pos
-        shift += 7
-    return result, pos
-
-def parse_distance_measurement(data):
-    source_id = 0
-    distance = 0.0
-    has_distance = False
-    pos = 0
-    while pos < len(data):
-        tag, pos = decode_varint(data, pos)
-        field_num = tag >> 3
-        wire_type = tag & 0x07
-        if field_num == 1 and wire_type == 0:
-            source_id, pos = decode_varint(data, pos)
-        elif field_num == 2 and wire_type == 5:
-            if pos + 4 <= len(data):
-                distance = struct.unpack('<f', data[pos:pos+4])[0]
-                has_distance = True
-                pos += 4
-        else:
-            if wire_type == 0:
-                _, pos = decode_varint(data, pos)
-            elif wire_type == 1:
-                pos += 8
-            elif wire_type == 2:
-                length, pos = decode_varint(data, pos)
-                pos += length
-            elif wire_type == 5:
-                pos += 4
-            else:
-                break
-    return source_id, distance, has_distance
-
-def parse_event(data):
-    pos = 0
-    event_type = None
-    details = None
-    while pos < len(data):
-        if pos >= len(data):
-            break
-        tag, pos = decode_varint(data, pos)
-        field_num = tag >> 3
-        wire_type = tag & 0x07
-        if wire_type == 2:
-            length, pos = decode_varint(data, pos)
-            if pos + length > len(data):
-                # Truncated!
-                return "TRUNCATED", {"field": field_num, "expected": length, "available": len(data) - pos, "raw_hex": data.hex()}
-            field_data = data[pos:pos+length]
-            pos += length
-            if field_num == 10:
-                sid, dist, has_dist = parse_distance_measurement(field_data)
-                event_type = "distance"
-                details = {"source_id": sid, "distance": dist, "has_distance": has_dist, "raw_hex": field_data.hex(), "dm_bytes": len(field_data)}
-            elif field_num == 12:
-                event_type = "geolocation"
-            elif field_num == 13:
-                event_type = "userInput"
-            elif field_num == 14:
-                event_type = "textMessage"
-                details = {"raw": field_data}
-            elif field_num == 6:
-                pass  # time
-            else:
-                if event_type is None:
-                    event_type = f"field_{field_num}"
-        elif wire_type == 0:
-            _, pos = decode_varint(data, pos)
-        elif wire_type == 1:
-            pos += 8
-        elif wire_type == 5:
-            pos += 4
-        else:
-            break
-    return event_type, details
-
-# Stats
-start_time = None
-count = 0
-dist_zero_no_field = 0
-dist_zero_explicit = 0
-dist_ok = 0
-truncated = 0
-sid1_zero = 0
-sid1_ok = 0
-sid2_zero = 0
-sid2_ok = 0
-
-def handle_notification(sender, data: bytearray):
+QUEUE_SIZE = 2048
+
+class Stats:
+    __slots__ = ("start_ns", "count", "dist_zero_no_field", "dist_zero_explicit", "dist_ok", "truncated",
+                 "dropped", "sid1_zero", "sid1_ok", "sid2_zero", "sid2_ok")
+
+    def __init__(self):
+        self.start_ns = None
+        self.count = 0
+        self.dist_zero_no_field = 0
+        self.dist_zero_explicit = 0
+        self.dist_ok = 0
+        self.truncated = 0
+        self.dropped = 0
+        self.sid1_zero = 0
+        self.sid1_ok = 0
+        self.sid2_zero = 0
+        self.sid2_ok = 0
+
+stats = Stats()
+
+def _elapsed():
+    return (time.monotonic_ns() - stats.start_ns) / 1e9
+
+# Log lines from the parser task, written out by main() in batches
+_log_buf = []
+
+def flush_log():
+    if _log_buf:
+        _log_buf.append("")
+        sys.stdout.write("\n".join(_log_buf))
+        sys.stdout.flush()
+        _log_buf.clear()
+
+def process_notification(data):
     """Each BLE notification = one protobuf event (no COBS on BLE)."""
-    global start_time, count, dist_zero_no_field, dist_zero_explicit, dist_ok, truncated
-    global sid1_zero, sid1_ok, sid2_zero, sid2_ok
-
-    if start_time is None:
-        start_time = time.time()
+    st = stats
+    if st.start_ns is None:
+        st.start_ns = time.monotonic_ns()
 
-    count += 1
-    elapsed = time.time() - start_time
+    st.count += 1
+    count = st.count
 
-    event_type, details = parse_event(bytes(data))
+    event_type, details = parse_event_fast(memoryview(data))
 
     if event_type == "TRUNCATED":
-        truncated += 1
-        print(f"[{elapsed:7.1f}s] #{count:5d}  *** TRUNCATED ***  field={details['field']} expected={details['expected']} got={details['available']}  raw={details['raw_hex']}")
+        st.truncated += 1
+        t = details
+        _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  *** TRUNCATED ***  field={t.field} expected={t.expected} got={t.available}  len={t.raw_len}  raw={t.raw_hex}")
     elif event_type == "distance":
         d = details
-        sid = d["source_id"]
-        if d["distance"] == 0.0 and not d["has_distance"]:
-            dist_zero_no_field += 1
-            if sid == 1: sid1_zero += 1
-            else: sid2_zero += 1
-            print(f"[{elapsed:7.1f}s] #{count:5d}  DIST  sid={sid}  dist=0.000m  *** NO DISTANCE FIELD ***  dm_bytes={d['dm_bytes']}  raw={d['raw_hex']}  full={data.hex()}")
-        elif d["distance"] == 0.0:
-            dist_zero_explicit += 1
-            if sid == 1: sid1_zero += 1
-            else: sid2_zero += 1
-            print(f"[{elapsed:7.1f}s] #{count:5d}  DIST  sid={sid}  dist=0.000m  *** EXPLICIT ZERO ***  raw={d['raw_hex']}  full={data.hex()}")
+        sid = d.source_id
+        if d.distance == 0.0 and not d.has_distance:
+            st.dist_zero_no_field += 1
+            if sid == 1: st.sid1_zero += 1
+            else: st.sid2_zero += 1
+            _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  DIST  sid={sid}  dist=0.000m  *** NO DISTANCE FIELD ***  dm_bytes={d.dm_bytes}  raw={hex_prefix(d.raw)}  full={hex_prefix(data)}")
+        elif d.distance == 0.0:
+            st.dist_zero_explicit += 1
+            if sid == 1: st.sid1_zero += 1
+            else: st.sid2_zero += 1
+            _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  DIST  sid={sid}  dist=0.000m  *** EXPLICIT ZERO ***  raw={hex_prefix(d.raw)}  full={hex_prefix(data)}")
         else:
-            dist_ok += 1
-            if sid == 1: sid1_ok += 1
-            else: sid2_ok += 1
+            st.dist_ok += 1
+            if sid == 1: st.sid1_ok += 1
+            else: st.sid2_ok += 1
             # Only print every 50th OK event to reduce noise
-            if dist_ok % 50 == 1:
-                print(f"[{elapsed:7.1f}s] #{count:5d}  DIST  sid={sid}  dist={d['distance']:.3f}m  OK  (showing every 50th)")
+            if st.dist_ok % 50 == 1:
+                _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  DIST  sid={sid}  dist={d.distance:.3f}m  OK  (showing every 50th)")
     elif event_type == "geolocation":
         pass  # silent
     elif event_type == "userInput":
-        print(f"[{elapsed:7.1f}s] #{count:5d}  BUTTON")
+        _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  BUTTON")
     elif event_type == "textMessage":
-        print(f"[{elapsed:7.1f}s] #{count:5d}  TEXT  {details}")
+        _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  TEXT  {details}")
     else:
-        print(f"[{elapsed:7.1f}s] #{count:5d}  {event_type}  ({len(data)} bytes)  raw={data.hex()}")
+        _log_buf.append(f"[{_elapsed():7.1f}s] #{count:5d}  {event_type or 'unknown'}  ({len(data)} bytes)  raw={hex_prefix(data)}")
+
+def process_batch(batch):
+    """Process notifications, logging (not raising) any that fail to parse."""
+    for data in batch:
+        try:
+            process_notification(data)
+        except Exception:
+            _log_buf.append(f"*** PARSE ERROR ***  ({len(data)} bytes)  raw={hex_prefix(data)}\n{traceback.format_exc().rstrip()}")
+
+async def parse_notifications(queue):
+    """Parse queued notifications, draining everything that is waiting per wakeup."""
+    while True:
+        batch = [await queue.get()]
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        process_batch(batch)
 
 async def main():
-    global start_time
+    st = stats
     print(f"Scanning for '{DEVICE_NAME}'...")
 
     device = await BleakScanner.find_device_by_name(DEVICE_NAME, timeout=10)
@@ -174,38 +128,58 @@ async def main():
         print(f"Subscribing to TX characteristic...")
         print(f"Reading events... (Ctrl+C to stop)\n")
 
+        queue = asyncio.Queue(QUEUE_SIZE)
+
+        def handle_notification(sender, data: bytearray):
+            try:
+                queue.put_nowait(bytes(data))
+            except asyncio.QueueFull:
+                st.dropped += 1
+
+        parser = asyncio.create_task(parse_notifications(queue))
         await client.start_notify(TX_CHAR_UUID, handle_notification)
 
         try:
             # Run for 120 seconds max
             for i in range(240):
                 await asyncio.sleep(0.5)
+                flush_log()
                 # Print stats every 10 seconds
-                if start_time and (i+1) % 20 == 0:
-                    elapsed = time.time() - start_time
-                    total_dist = dist_ok + dist_zero_no_field + dist_zero_explicit
-                    zero_total = dist_zero_no_field + dist_zero_explicit
-                    print(f"\n--- Stats at {elapsed:.0f}s: events={count}, dist_ok={dist_ok}, zero_no_field={dist_zero_no_field}, zero_explicit={dist_zero_explicit}, truncated={truncated} ---")
-                    print(f"    sid1: ok={sid1_ok} zero={sid1_zero} | sid2: ok={sid2_ok} zero={sid2_zero}")
+                if st.start_ns is not None and (i+1) % 20 == 0:
+                    elapsed = _elapsed()
+                    total_dist = st.dist_ok + st.dist_zero_no_field + st.dist_zero_explicit
+                    zero_total = st.dist_zero_no_field + st.dist_zero_explicit
+                    print(f"\n--- Stats at {elapsed:.0f}s: events={st.count}, dist_ok={st.dist_ok}, zero_no_field={st.dist_zero_no_field}, zero_explicit={st.dist_zero_explicit}, truncated={st.truncated}, dropped={st.dropped} ---")
+                    print(f"    sid1: ok={st.sid1_ok} zero={st.sid1_zero} | sid2: ok={st.sid2_ok} zero={st.sid2_zero}")
                     if total_dist > 0:
                         print(f"    Zero rate: {zero_total/total_dist*100:.1f}%")
                     print()
         except KeyboardInterrupt:
             pass
-
-        await client.stop_notify(TX_CHAR_UUID)
-
-    elapsed = time.time() - start_time if start_time else 0
-    total_dist = dist_ok + dist_zero_no_field + dist_zero_explicit
-    zero_total = dist_zero_no_field + dist_zero_explicit
+        finally:
+            # Ctrl+C surfaces here as CancelledError on newer Pythons
+            await client.stop_notify(TX_CHAR_UUID)
+            parser.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await parser
+            leftover = []
+            while not queue.empty():
+                leftover.append(queue.get_nowait())
+            process_batch(leftover)
+            flush_log()
+
+    elapsed = _elapsed() if st.start_ns is not None else 0
+    total_dist = st.dist_ok + st.dist_zero_no_field + st.dist_zero_explicit
+    zero_total = st.dist_zero_no_field + st.dist_zero_explicit
     print(f"\n=== FINAL RESULTS ({elapsed:.0f}s) ===")
-    print(f"Total events: {count}")
-    print(f"Distance OK: {dist_ok}")
-    print(f"Distance ZERO (no field): {dist_zero_no_field}")
-    print(f"Distance ZERO (explicit): {dist_zero_explicit}")
-    print(f"Truncated: {truncated}")
-    print(f"sid1: ok={sid1_ok} zero={sid1_zero}")
-    print(f"sid2: ok={sid2_ok} zero={sid2_zero}")
+    print(f"Total events: {st.count}")
+    print(f"Distance OK: {st.dist_ok}")
+    print(f"Distance ZERO (no field): {st.dist_zero_no_field}")
+    print(f"Distance ZERO (explicit): {st.dist_zero_explicit}")
+    print(f"Truncated: {st.truncated}")
+    print(f"Dropped (queue full): {st.dropped}")
+    print(f"sid1: ok={st.sid1_ok} zero={st.sid1_zero}")
+    print(f"sid2: ok={st.sid2_ok} zero={st.sid2_zero}")
     if total_dist > 0:
         print(f"Zero rate: {zero_total/total_dist*100:.1f}%")
 